@@ -8,12 +8,15 @@ __license__ = 'MIT'
 from . import _widget as widget, _frm as form, _http_api_controllers as http_api_controllers
 from ._controllers import AuthFilter
 from ._api import base_path, register_driver, get_driver, get_drivers, sign_in_form, sign_in_url, sign_up_form, \
-    sign_up_url, sign_out_url, restore_account_form, role_form, user_form
+    sign_up_url, sign_out_url, restore_account_form, role_form, user_form, on_role_form_submit, on_user_form_submit, \
+    user_profile_view_url, user_profile_modify_url, sign_up_confirm_url, auth_urls
 from ._driver import Driver
+from ._identity_map import get_user, get_role, stats as identity_map_stats
+from ._mail_queue import flush as flush_mail_queue, stats as mail_queue_stats
 
 
 def plugin_load_wsgi():
-    from pytsite import router
+    from pytsite import router, cron
     from plugins import robots_txt, auth, http_api
     from . import _controllers, _http_api_controllers, _eh
 
@@ -32,11 +35,19 @@ def plugin_load_wsgi():
     # HTTP API routes
     http_api.handle('GET', 'auth_ui/widget/user_select', _http_api_controllers.GetWidgetUserSelect,
                     'auth_ui@get_widget_user_select')
+    http_api.handle('POST', 'auth_ui/users/bulk', _http_api_controllers.PostUsersBulk, 'auth_ui@post_users_bulk')
+    http_api.handle('GET', 'auth_ui/users/bulk/<job_uid>', _http_api_controllers.GetUsersBulk,
+                    'auth_ui@get_users_bulk')
 
     # Events handlers
     auth.on_sign_up(_eh.on_auth_sign_up)
     auth.on_user_status_change(_eh.on_auth_user_status_change)
     auth.on_user_as_jsonable(_eh.on_auth_user_as_jsonable)
+    auth.on_user_save(_eh.on_auth_user_save)
+    auth.on_user_delete(_eh.on_auth_user_delete)
+    auth.on_role_save(_eh.on_auth_role_save)
+    auth.on_role_delete(_eh.on_auth_role_delete)
+    cron.hourly(_eh.on_cron_hourly)
 
     # robots.txt rules
     robots_txt.disallow(bp + '/')
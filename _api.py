@@ -4,14 +4,81 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from typing import Dict
+from typing import Callable, Dict, Mapping, Optional, Tuple
 from collections import OrderedDict
-from pytsite import router, reg, http, util
+from functools import wraps
+from types import MappingProxyType
+from urllib.parse import quote
+from pytsite import router, reg, http, util, events, lang
 from plugins import form, http_api
-from . import _error
+from . import _error, _cache
 from ._driver import Driver as _Driver
 
 _drivers = OrderedDict()  # type: Dict[str, _Driver]
+_drivers_view = MappingProxyType(_drivers)
+
+# Default driver resolved for particular registry value: (registry value, driver)
+_default_driver = None  # type: Optional[Tuple[str, _Driver]]
+
+# URLs of rules with single path argument: {(rule_name, language, base_url): url with placeholder}. Base URL
+# depends on request's host, so the number of entries is bounded.
+_url_templates = _cache.LRUCache(100, 3600)
+
+_URL_ARG_PLACEHOLDER = 'AUTHUIURLARGPLACEHOLDER'
+
+_REQUEST_MEMO_ATTR_NAME = '_auth_ui_urls'
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    elif isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+
+    return value
+
+
+def _request_memoized(func: Callable) -> Callable:
+    """Memoize function's results within the current request
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        request = router.request()
+        if request is None:
+            return func(*args, **kwargs)
+
+        try:
+            memo = getattr(request, _REQUEST_MEMO_ATTR_NAME)
+        except AttributeError:
+            memo = {}
+            setattr(request, _REQUEST_MEMO_ATTR_NAME, memo)
+
+        key = (func.__name__, _freeze(list(args)), _freeze(kwargs))
+        try:
+            hash(key)
+        except TypeError:
+            # Unhashable arguments
+            return func(*args, **kwargs)
+
+        if key not in memo:
+            memo[key] = func(*args, **kwargs)
+
+        return memo[key]
+
+    return wrapper
+
+
+def _rule_url(rule_name: str, arg_name: str, arg_value: str) -> str:
+    """Get URL of a rule with single path argument using string substitution instead of route resolution
+    """
+    key = (rule_name, lang.get_current(), router.base_url())
+    try:
+        template = _url_templates.get(key)
+    except _cache.KeyNotExist:
+        template = _url_templates.put(key, router.rule_url(rule_name, {arg_name: _URL_ARG_PLACEHOLDER}))
+
+    return template.replace(_URL_ARG_PLACEHOLDER, quote(arg_value, safe=''))
 
 
 def base_path() -> str:
@@ -23,15 +90,23 @@ def base_path() -> str:
 def register_driver(driver: _Driver):
     """Register a driver
     """
+    global _default_driver
+
     if driver.name in _drivers:
         raise _error.DriverAlreadyRegistered(driver.name)
 
     _drivers[driver.name] = driver
+    _default_driver = None
 
 
 def get_driver(name: str = None) -> _Driver:
     """Get a driver
+
+    Default driver is resolved once and then only when a driver is registered or 'auth.ui_driver' registry value
+    changes.
     """
+    global _default_driver
+
     if not _drivers:
         raise _error.NoDriversRegistered()
 
@@ -42,21 +117,24 @@ def get_driver(name: str = None) -> _Driver:
             raise _error.DriverNotRegistered(name)
 
     else:
-        d_names = list(_drivers.keys())
+        reg_value = reg.get('auth.ui_driver')
+        cached = _default_driver
+        if cached and cached[0] == reg_value:
+            return cached[1]
 
-        try:
-            # Try to get default driver defined in registry
-            return _drivers[reg.get('auth.ui_driver', d_names[0])]
+        # Default driver defined in registry or first registered one
+        driver = _drivers.get(reg_value) or next(iter(_drivers.values()))
+        _default_driver = (reg_value, driver)
 
-        except KeyError:
-            # Get first registered driver
-            return _drivers[d_names[0]]
+        return driver
 
 
-def get_drivers() -> Dict[str, _Driver]:
+def get_drivers() -> Mapping[str, _Driver]:
     """Get registered drivers
+
+    Returns read-only view which reflects drivers registered later.
     """
-    return _drivers.copy()
+    return _drivers_view
 
 
 def sign_in_form(request: http.Request = None, driver_name: str = None, **kwargs) -> form.Form:
@@ -73,6 +151,7 @@ def sign_in_form(request: http.Request = None, driver_name: str = None, **kwargs
     return driver.get_sign_in_form(request or router.request(), **kwargs)
 
 
+@_request_memoized
 def sign_in_url(driver_name: str = None, redirect: str = 'CURRENT_URL', add_query: dict = None,
                 add_fragment: str = '') -> str:
     """Get sign in URL
@@ -101,6 +180,7 @@ def sign_up_form(request: http.Request = None, driver_name: str = None, **kwargs
     return driver.get_sign_up_form(request or router.request(), **kwargs)
 
 
+@_request_memoized
 def sign_up_url(driver_name: str = None, add_query: dict = None, add_fragment: str = '') -> str:
     """Get sign up URL
     """
@@ -110,6 +190,7 @@ def sign_up_url(driver_name: str = None, add_query: dict = None, add_fragment: s
     })
 
 
+@_request_memoized
 def sign_out_url(redirect: str = 'CURRENT_URL') -> str:
     """Get sign out URL
     """
@@ -118,6 +199,35 @@ def sign_out_url(redirect: str = 'CURRENT_URL') -> str:
     return router.rule_url('auth_ui@sign_out', rule_args)
 
 
+@_request_memoized
+def auth_urls(driver_name: str = None, redirect: str = 'CURRENT_URL') -> Dict[str, str]:
+    """Get sign in, sign up and sign out URLs for the current request
+    """
+    return {
+        'sign_in': sign_in_url(driver_name, redirect),
+        'sign_up': sign_up_url(driver_name),
+        'sign_out': sign_out_url(redirect),
+    }
+
+
+def user_profile_view_url(nickname: str) -> str:
+    """Get user's profile view URL
+    """
+    return _rule_url('auth_ui@user_profile_view', 'nickname', nickname)
+
+
+def user_profile_modify_url(nickname: str) -> str:
+    """Get user's profile modification URL
+    """
+    return _rule_url('auth_ui@user_profile_modify', 'nickname', nickname)
+
+
+def sign_up_confirm_url(code: str) -> str:
+    """Get sign up confirmation URL
+    """
+    return _rule_url('auth_ui@sign_up_confirm', 'code', code)
+
+
 def restore_account_form(request: http.Request = None, driver_name: str = None, **kwargs) -> form.Form:
     """Get account restoration form
     """
@@ -145,3 +255,19 @@ def user_form(request: http.Request = None, user_uid: str = None) -> form.Form:
     form_cls = util.get_module_attr(reg.get('auth_ui.user_form_class', 'plugins.auth_ui._frm.User'))
 
     return form_cls(request or router.request(), user_uid=user_uid)
+
+
+def on_role_form_submit(handler: Callable, priority: int = 0):
+    """Shortcut
+
+    Handler receives `role` and `changed_fields` keyword arguments.
+    """
+    events.listen('auth_ui@role_form_submit', handler, priority)
+
+
+def on_user_form_submit(handler: Callable, priority: int = 0):
+    """Shortcut
+
+    Handler receives `user` and `changed_fields` keyword arguments.
+    """
+    events.listen('auth_ui@user_form_submit', handler, priority)
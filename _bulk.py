@@ -0,0 +1,86 @@
+"""PytSite Auth UI Plugin Bulk Users Administration
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from uuid import uuid4
+from typing import List, Optional
+from pytsite import cache, reg, logger, threading
+from plugins import auth, query
+from . import _frm
+
+_FIELDS = ('status', 'roles', 'is_public')
+
+_pool = cache.create_pool('auth_ui@bulk_jobs')
+
+
+def _set_progress(job_uid: str, progress: dict):
+    _pool.put(job_uid, progress, reg.get('auth_ui.bulk_job_ttl', 86400))
+
+
+def _run(job_uid: str, uids: List[str], values: dict):
+    chunk_size = reg.get('auth_ui.bulk_chunk_size', 100)
+    progress = {'status': 'running', 'total': len(uids), 'processed': 0, 'changed': 0, 'failed': []}
+    _set_progress(job_uid, progress)
+
+    try:
+        auth.switch_user_to_system()
+
+        for i in range(0, len(uids), chunk_size):
+            chunk = uids[i:i + chunk_size]
+
+            # Users of a chunk are loaded using single query
+            users = {u.uid: u for u in auth.find_users(query.Query(query.In('_id', chunk)))}
+
+            for uid in chunk:
+                try:
+                    user = users.get(uid)
+                    if not user:
+                        raise auth.error.UserNotFound("User '{}' not found".format(uid))
+                    if _frm.set_changed_fields(user, values):
+                        user.save()
+                        progress['changed'] += 1
+                except Exception as e:
+                    logger.error('Bulk modification of user {} failed: {}'.format(uid, e), exc_info=e)
+                    progress['failed'].append(uid)
+
+                progress['processed'] += 1
+
+            # Progress is published once per chunk
+            _set_progress(job_uid, progress)
+
+        progress['status'] = 'done'
+
+    except Exception as e:
+        logger.error('Bulk modification of users failed: {}'.format(e), exc_info=e)
+        progress['status'] = 'failed'
+
+    finally:
+        auth.restore_user()
+        _set_progress(job_uid, progress)
+
+
+def start(uids: List[str], values: dict) -> str:
+    """Start bulk modification of users in background
+
+    Supported fields are 'status', 'roles' and 'is_public'. Returns job's UID to check its progress.
+    """
+    for k in values:
+        if k not in _FIELDS:
+            raise ValueError("Field '{}' cannot be modified in bulk".format(k))
+
+    job_uid = uuid4().hex
+    _set_progress(job_uid, {'status': 'pending', 'total': len(uids), 'processed': 0, 'changed': 0, 'failed': []})
+    threading.run_in_thread(_run, job_uid=job_uid, uids=list(uids), values=dict(values))
+
+    return job_uid
+
+
+def get_progress(job_uid: str) -> Optional[dict]:
+    """Get progress of bulk modification job
+    """
+    try:
+        return _pool.get(job_uid)
+    except cache.error.KeyNotExist:
+        return None
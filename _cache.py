@@ -0,0 +1,153 @@
+"""PytSite Auth UI Plugin In-process Caches
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import copy
+import threading
+from collections import OrderedDict
+from time import time
+from typing import Any, Callable, Hashable
+
+
+class KeyNotExist(KeyError):
+    pass
+
+
+class CallFailed(Exception):
+    """Raised to a coalesced caller when the leader's error cannot be copied
+    """
+    pass
+
+
+class LRUCache:
+    """Bounded thread safe LRU cache with per item TTL
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 60):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Get an item
+
+        Raises KeyNotExist if there is no such item or it is expired.
+        """
+        with self._lock:
+            try:
+                expires, value = self._items[key]
+            except KeyError:
+                self._misses += 1
+                raise KeyNotExist(key)
+
+            if expires < time():
+                del self._items[key]
+                self._misses += 1
+                raise KeyNotExist(key)
+
+            self._items.move_to_end(key)
+            self._hits += 1
+
+            return value
+
+    def put(self, key: Hashable, value: Any, ttl: float = None) -> Any:
+        """Put an item
+        """
+        with self._lock:
+            self._items[key] = (time() + (self._ttl if ttl is None else ttl), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self._max_size:
+                self._items.popitem(False)
+
+        return value
+
+    def rm(self, key: Hashable):
+        """Remove an item
+        """
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        """Remove all items
+        """
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        """Get usage statistics
+        """
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'max_size': self._max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+            }
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls, so only one of them is executed and others share its result
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._executed = 0
+        self._coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Call the function or wait for the result of the same key call which is in progress
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call:
+                self._coalesced += 1
+                is_leader = False
+            else:
+                call = self._calls[key] = self._Call()
+                self._executed += 1
+                is_leader = True
+
+        if not is_leader:
+            call.done.wait()
+            if call.error:
+                # Every waiter gets its own exception object, so concurrent raises don't share traceback and context
+                try:
+                    error = copy.copy(call.error)
+                except Exception:
+                    error = CallFailed(str(call.error))
+                raise error from call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def stats(self) -> dict:
+        """Get usage statistics
+        """
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executed': self._executed,
+                'coalesced': self._coalesced,
+            }
@@ -4,10 +4,51 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
+import threading
+from hashlib import md5
+from datetime import datetime, timedelta
+from time import time
+from email.utils import formatdate, parsedate_tz, mktime_tz
 from typing import Union, Optional
-from pytsite import lang, http, metatag, tpl, router, util, routing
+from urllib.parse import urlencode
+from pytsite import lang, http, metatag, tpl, router, util, routing, reg
 from plugins import auth, query
-from . import _api
+from . import _api, _identity_map, _cache, _tokens
+
+# Profile pages rendered for anonymous viewers: {(nickname, language, base_url): (html, etag, modified)}
+profile_view_cache = _cache.LRUCache(reg.get('auth_ui.profile_cache_size', 1000),
+                                     reg.get('auth_ui.profile_cache_ttl', 300))
+
+# Prerendered anonymous forms' pages: {(driver, form_type, language, base_url): html}
+form_page_cache = _cache.LRUCache(100, reg.get('auth_ui.form_cache_ttl', 0))
+
+# Substituted with actual redirect URL when cached form page is served
+_REDIRECT_PLACEHOLDER = 'AUTHUIREDIRECTPLACEHOLDER'
+
+# Request arguments which do not affect forms' rendering except redirect
+_FORM_ROUTE_ARGS = ('driver', '__redirect', '_pytsite_router_rule_name')
+
+# Sign in URLs without query: {(driver, language, base_url): url}
+_sign_in_urls = _cache.LRUCache(100, 3600)
+
+# Keys of users' cached profile pages, to invalidate them on user's change: {uid: {(nickname, lang, base_url)}}
+_profile_view_keys = _cache.LRUCache(reg.get('auth_ui.profile_cache_size', 1000),
+                                     reg.get('auth_ui.profile_cache_ttl', 300))
+_profile_view_keys_lock = threading.Lock()
+
+
+def invalidate_profile_view(user: auth.AbstractUser):
+    """Remove cached profile pages of a user
+    """
+    with _profile_view_keys_lock:
+        try:
+            keys = _profile_view_keys.get(user.uid)
+            _profile_view_keys.rm(user.uid)
+        except _cache.KeyNotExist:
+            return
+
+    for key in keys:
+        profile_view_cache.rm(key)
 
 
 class AuthFilter(routing.Filter):
@@ -19,17 +60,21 @@ class AuthFilter(routing.Filter):
             return
 
         # Redirecting to the authorization endpoint
-        inp = self.request.inp.copy()
-        inp.update({
-            'driver': _api.get_driver().name,
-            '__redirect': util.escape_html(router.current_url(True)),
-        })
+        driver_name = _api.get_driver().name
+        url_key = (driver_name, lang.get_current(), router.base_url())
+        try:
+            url = _sign_in_urls.get(url_key)
+        except _cache.KeyNotExist:
+            url = _sign_in_urls.put(url_key, router.rule_url('auth_ui@sign_in', {'driver': driver_name}))
 
-        return self.redirect(router.rule_url('auth_ui@sign_in', inp))
+        url_query = [(k, v) for k, v in self.request.inp.items() if k not in ('driver', '__redirect')]
+        url_query.append(('__redirect', util.escape_html(router.current_url(True))))
+
+        return self.redirect(url + ('&' if '?' in url else '?') + urlencode(url_query, True))
 
 
 class Form(routing.Controller):
-    def exec(self) -> Union[str, http.RedirectResponse]:
+    def exec(self) -> Union[str, http.Response]:
         # Redirect to the base URL if user is already authenticated
         if not auth.get_current_user().is_anonymous:
             return self.redirect(self.arg('__redirect', router.base_url()))
@@ -41,15 +86,30 @@ class Form(routing.Controller):
             raise self.not_found()
 
         rule_name = self.arg('_pytsite_router_rule_name')
+
+        # Check if sign up is enabled, before cached page could be served
+        if 'sign_up' in rule_name and not auth.is_sign_up_enabled():
+            raise self.not_found()
+
+        # Prerendered pages are identical for all anonymous visitors, except redirect URL. Pages rendered while the
+        # session holds flash messages contain them, so such requests neither read nor fill the cache.
+        cache_key = None
+        if reg.get('auth_ui.form_cache_ttl', 0) and not router.session().get('__flash') \
+                and not [k for k in self.request.inp if k not in _FORM_ROUTE_ARGS]:
+            cache_key = (driver_name, rule_name, lang.get_current(), router.base_url())
+            try:
+                html = form_page_cache.get(cache_key)
+                redirect = router.base_url() if 'restore_account' in rule_name else \
+                    self.arg('__redirect') or router.base_url()
+                return html.replace(_REDIRECT_PLACEHOLDER, util.escape_html(redirect))
+            except _cache.KeyNotExist:
+                pass
+
         if 'sign_in' in rule_name:
             form_type = 'sign-in'
             form = _api.sign_in_form(self.request, driver_name)
 
         elif 'sign_up' in rule_name:
-            # Check if sign up is enabled
-            if not auth.is_sign_up_enabled():
-                raise self.not_found()
-
             form_type = 'sign-up'
             form = _api.sign_up_form(self.request, driver_name)
 
@@ -72,21 +132,55 @@ class Form(routing.Controller):
             'form': form,
         }
 
+        redirect = form.redirect
+        if cache_key:
+            form.redirect = _REDIRECT_PLACEHOLDER
+
         try:
-            return router.call('auth_ui_form', tpl_args)
+            r = router.call('auth_ui_form', tpl_args)
         except routing.error.RuleNotFound:
-            return tpl.render('auth_ui/form', tpl_args)
+            r = tpl.render('auth_ui/form', tpl_args)
+
+        if cache_key:
+            if isinstance(r, str):
+                r = form_page_cache.put(cache_key, r).replace(_REDIRECT_PLACEHOLDER, util.escape_html(redirect))
+            elif isinstance(r, http.Response):
+                # Responses built by application's handlers are not cached
+                r.set_data(r.get_data(True).replace(_REDIRECT_PLACEHOLDER, util.escape_html(redirect)))
+
+        return r
 
 
 class SignUpConfirm(routing.Controller):
     """Confirm Sign Up
     """
 
+    def _find_user(self, code: str) -> Optional[auth.AbstractUser]:
+        user_uid = _tokens.pop(code)
+        if user_uid:
+            try:
+                user = auth.get_user(uid=user_uid)
+                return user if user.confirmation_hash == code else None
+            except auth.error.UserNotFound:
+                return None
+
+        # Tokens issued before the token store was introduced, only those which would not be expired yet
+        if reg.get('auth_ui.confirmation_legacy_lookup', True):
+            try:
+                return next(auth.find_users(query.Query([
+                    query.Eq('confirmation_hash', code),
+                    query.Gte('created', datetime.now() - timedelta(seconds=_tokens.get_ttl())),
+                ])))
+            except StopIteration:
+                pass
+
+        return None
+
     def exec(self):
-        try:
-            # Search for user
-            user = next(auth.find_users(query.Query(query.Eq('confirmation_hash', self.arg('code')))))
-        except StopIteration:
+        # Search for user
+        code = self.arg('code')
+        user = self._find_user(code)
+        if not user:
             # No user found, redirect to sign in URL
             return self.redirect(_api.sign_in_url(redirect=router.base_url()))
 
@@ -96,6 +190,10 @@ class SignUpConfirm(routing.Controller):
             if user.status == auth.USER_STATUS_WAITING:
                 user.status = auth.get_new_user_status()
             user.save()
+        except Exception:
+            # Token is already taken from the store, so it is put back to keep the link usable
+            _tokens.put(code, user.uid)
+            raise
         finally:
             auth.restore_user()
 
@@ -123,16 +221,54 @@ class UserProfileView(routing.Controller):
 
         self.args.add_validation('nickname', auth.user_nickname_rule)
 
-    def exec(self) -> str:
+    def _cached_response(self, html: str, etag: str, modified: float) -> http.Response:
+        # Cached page must be revalidated by the browser on every request
+        router.private(True)
+        router.no_cache(True)
+
+        headers = {
+            'ETag': etag,
+            'Last-Modified': formatdate(modified, usegmt=True),
+        }
+
+        if_none_match = self.request.headers.get('If-None-Match')
+        if_modified_since = self.request.headers.get('If-Modified-Since')
+        if if_none_match:
+            not_modified = etag in [t.strip() for t in if_none_match.split(',')] or if_none_match.strip() == '*'
+        elif if_modified_since:
+            since = parsedate_tz(if_modified_since)
+            not_modified = bool(since) and int(modified) <= mktime_tz(since)
+        else:
+            not_modified = False
+
+        if not_modified:
+            return http.Response(status=304, headers=headers)
+
+        return http.Response(html, headers=headers, mimetype='text/html')
+
+    def exec(self) -> Union[str, http.Response]:
+        nickname = self.arg('nickname')
+        c_user = auth.get_current_user()
+
+        # Layouts usually contain current user's information, so only pages rendered for anonymous viewers are cached.
+        # Pages rendered while the session holds flash messages contain them, so such requests bypass the cache.
+        cache_key = None
+        if c_user.is_anonymous and not router.session().get('__flash'):
+            cache_key = (nickname, lang.get_current(), router.base_url())
+        if cache_key:
+            try:
+                return self._cached_response(*profile_view_cache.get(cache_key))
+            except _cache.KeyNotExist:
+                pass
+
         try:
-            user = auth.get_user(nickname=self.arg('nickname'))
+            user = _identity_map.get_user(nickname=nickname)
         except auth.error.UserNotFound:
             raise self.not_found()
 
         if not user.is_active:
             raise self.not_found()
 
-        c_user = auth.get_current_user()
         if not user.is_public and not (c_user == user or c_user.is_admin):
             raise self.not_found()
 
@@ -140,9 +276,27 @@ class UserProfileView(routing.Controller):
         metatag.t_set('title', lang.t('auth_ui@profile_view_title', {'name': user.first_last_name}))
 
         try:
-            return router.call('auth_ui_user_profile_view', self.args)
+            r = router.call('auth_ui_user_profile_view', self.args)
         except routing.error.RuleNotFound:
-            return tpl.render('auth_ui/user-profile-view', self.args)
+            r = tpl.render('auth_ui/user-profile-view', self.args)
+
+        # Only rendered HTML can be cached, responses returned by application's handlers are passed as is
+        if not cache_key or not isinstance(r, str):
+            return r
+
+        # Router minifies only string responses, so cached page is minified here
+        if reg.get('output.minify'):
+            r = util.minify_html(r)
+
+        entry = profile_view_cache.put(cache_key, (r, '"{}"'.format(md5(r.encode('utf-8')).hexdigest()), time()))
+        with _profile_view_keys_lock:
+            try:
+                keys = _profile_view_keys.get(user.uid) | {cache_key}
+            except _cache.KeyNotExist:
+                keys = {cache_key}
+            _profile_view_keys.put(user.uid, keys)
+
+        return self._cached_response(*entry)
 
 
 class UserProfileModify(routing.Controller):
@@ -156,7 +310,7 @@ class UserProfileModify(routing.Controller):
 
     def exec(self) -> str:
         try:
-            self.args['form'] = _api.user_form(self.request, auth.get_user(nickname=self.arg('nickname')).uid)
+            self.args['form'] = _api.user_form(self.request, _identity_map.get_user(nickname=self.arg('nickname')).uid)
         except auth.error.UserNotFound:
             raise self.not_found()
 
@@ -6,6 +6,8 @@ __license__ = 'MIT'
 
 from pytsite import router, lang, mail, tpl
 from plugins import auth
+from . import _user_index, _http_api_controllers, _widget, _controllers, _identity_map, _tokens, _mail_queue, \
+    _notify, _api
 
 
 def on_auth_sign_up(user: auth.AbstractUser):
@@ -14,32 +16,65 @@ def on_auth_sign_up(user: auth.AbstractUser):
 
     # Send a confirmation email to the user
     if auth.is_sign_up_confirmation_required():
+        if not user.is_confirmed:
+            _tokens.put(user.confirmation_hash, user.uid)
+
         msg = tpl.render('auth_ui@mail/{}/sign-up'.format(lang.get_current()), {
             'user': user,
-            'confirm_url': router.rule_url('auth_ui@sign_up_confirm',
-                                           {'code': user.confirmation_hash}) if not user.is_confirmed else None
+            'confirm_url': _api.sign_up_confirm_url(user.confirmation_hash) if not user.is_confirmed else None
         })
-        mail.Message(user.login, lang.t('auth_ui@confirm_registration'), msg).send()
+        _mail_queue.enqueue(mail.Message(user.login, lang.t('auth_ui@confirm_registration'), msg))
 
     # Send a notification emails to admins
     if auth.is_sign_up_admins_notification_enabled():
-        for admin in auth.get_admin_users():
-            msg = tpl.render('auth_ui@mail/{}/sign-up-admin-notify'.format(lang.get_current()), {
-                'admin': admin,
-                'user': user,
-            })
-            mail.Message(admin.login, lang.t('auth_ui@registration_admin_notify'), msg).send()
+        tpl_name = 'auth_ui@mail/{}/sign-up-admin-notify'.format(lang.get_current())
+        for admin, msg in _notify.render_for_admins(tpl_name, {'user': user}):
+            _mail_queue.enqueue(mail.Message(admin.login, lang.t('auth_ui@registration_admin_notify'), msg))
 
 
 def on_auth_user_status_change(user: auth.AbstractUser, status: str):
+    _http_api_controllers.user_select_cache.clear()
+    _controllers.invalidate_profile_view(user)
+
     if auth.is_user_status_change_notification_enabled():
         msg = tpl.render('auth_ui@mail/{}/user-status-change'.format(lang.get_current()), {
             'user': user,
             'status': status,
         })
-        mail.Message(user.login, lang.t('auth_ui@user_status_change_notify'), msg).send()
+        _notify.schedule_status_change_message(
+            user, mail.Message(user.login, lang.t('auth_ui@user_status_change_notify'), msg))
 
 
 def on_auth_user_as_jsonable(user: auth.AbstractUser, data: dict):
     if user.is_public:
-        data['url'] = router.rule_url('auth_ui@user_profile_view', {'nickname': user.nickname})
+        data['url'] = _api.user_profile_view_url(user.nickname)
+
+
+def on_auth_user_save(user: auth.AbstractUser):
+    _user_index.update(user)
+    _http_api_controllers.user_select_cache.clear()
+    _controllers.invalidate_profile_view(user)
+    _identity_map.forget_nickname(user.nickname)
+    _notify.invalidate_admin_users(user)
+
+
+def on_auth_user_delete(user: auth.AbstractUser):
+    _user_index.remove(user)
+    _http_api_controllers.user_select_cache.clear()
+    _controllers.invalidate_profile_view(user)
+    _identity_map.forget_nickname(user.nickname)
+    _notify.invalidate_admin_users(user)
+
+
+def on_auth_role_save(role: auth.model.AbstractRole):
+    _widget.roles_items_cache.clear()
+    _notify.invalidate_admin_users()
+
+
+def on_auth_role_delete(role: auth.model.AbstractRole):
+    _widget.roles_items_cache.clear()
+    _notify.invalidate_admin_users()
+
+
+def on_cron_hourly():
+    _tokens.sweep_waiting_users()
@@ -4,9 +4,77 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from pytsite import validation, errors, router, lang
-from plugins import form, auth, widget, file_ui, permissions
-from . import _widget
+from typing import Dict, List, Tuple, Union
+from pytsite import validation, errors, router, lang, events
+from plugins import form, auth, widget, file_ui, permissions, query
+from . import _widget, _identity_map, _api
+
+# Role form's permissions tabs per language: (permissions fingerprint, [(tab_id, title, items), ...])
+_permissions_layouts = {}  # type: Dict[str, Tuple[tuple, List[Tuple[str, str, List[Tuple[str, str]]]]]]
+
+
+def _get_permissions_layout() -> List[Tuple[str, str, List[Tuple[str, str]]]]:
+    """Get role form's permissions tabs layout for the current language
+
+    Permissions can only be defined, not removed, so their counts are enough to detect changes.
+    """
+    groups = permissions.get_permission_groups()
+    fingerprint = (len(groups), len(permissions.get_permissions()))
+    c_lang = lang.get_current()
+
+    cached = _permissions_layouts.get(c_lang)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+
+    layout = []
+    for g_name, g_desc in sorted(groups.items(), key=lambda x: x[0]):
+        if g_name == 'auth':
+            continue
+
+        perms = permissions.get_permissions(g_name)
+        if not perms:
+            continue
+
+        layout.append(('permissions-' + g_name, lang.t(g_desc), [(p[0], lang.t(p[1])) for p in perms]))
+
+    _permissions_layouts[c_lang] = (fingerprint, layout)
+
+    return layout
+
+
+def set_changed_fields(entity: Union[auth.model.AbstractUser, auth.model.AbstractRole],
+                        values: dict) -> List[str]:
+    """Set entity's fields which values differ from the current ones
+
+    Values are compared after setting, so the entity's own normalization applies to the both sides of comparison.
+    """
+    changed = []
+
+    for k, v in values.items():
+        old_value = entity.get_field(k)
+        entity.set_field(k, v)
+        if entity.get_field(k) != old_value:
+            changed.append(k)
+
+    return changed
+
+
+def _find_non_unique_fields(e_type: str, values: dict, exclude_uid: str = None) -> List[str]:
+    """Check uniqueness of several entity's fields using single query
+    """
+    values = {k: v for k, v in values.items() if v}
+    if not values:
+        return []
+
+    q = query.Query(query.Or([query.Eq(k, v) for k, v in values.items()]))
+    finder = auth.find_users if e_type == 'user' else auth.find_roles
+
+    r = set()
+    for entity in finder(q):
+        if entity.uid != exclude_uid:
+            r.update(k for k, v in values.items() if entity.get_field(k) == v)
+
+    return sorted(r)
 
 
 class Role(form.Form):
@@ -22,7 +90,7 @@ class Role(form.Form):
 
     def _on_setup_widgets(self):
         role_uid = self.attr('role_uid')
-        role = auth.get_role(uid=role_uid) if role_uid != '0' else None
+        role = _identity_map.get_role(uid=role_uid) if role_uid != '0' else None
 
         self.add_widget(widget.input.Text(
             uid='name',
@@ -31,12 +99,6 @@ class Role(form.Form):
             required=True,
             enabled=role.name not in ('anonymous', 'user') if role else True,
         ))
-        self.add_rule('name', auth.validation.AuthEntityFieldUnique(
-            e_type='role',
-            field_name='name',
-            exclude_uids=role.uid if role else None,
-        ))
-
         self.add_widget(widget.input.Text(
             uid='description',
             value=role.description if role else None,
@@ -52,23 +114,15 @@ class Role(form.Form):
         )
 
         # Permissions tabs content
-        for g_name, g_desc in sorted(permissions.get_permission_groups().items(), key=lambda x: x[0]):
-            if g_name == 'auth':
-                continue
-
-            perms = permissions.get_permissions(g_name)
-            if not perms:
-                continue
-
+        for tab_id, tab_title, items in _get_permissions_layout():
             # Tab
-            tab_id = 'permissions-' + g_name
-            perms_tabs.add_tab(tab_id, lang.t(g_desc))
+            perms_tabs.add_tab(tab_id, tab_title)
 
             # Tab's content
             perms_tabs.add_widget(widget.select.Checkboxes(
                 uid='permission-checkboxes-' + tab_id,
                 name='permissions',
-                items=[(p[0], lang.t(p[1])) for p in perms],
+                items=list(items),
                 value=role.permissions if role else [],
             ), tab_id)
 
@@ -84,20 +138,30 @@ class Role(form.Form):
             href=self.referer or self.redirect or router.base_url(),
         ))
 
+    def _on_validate(self):
+        role_uid = self.attr('role_uid')
+        non_unique = _find_non_unique_fields('role', {'name': self.val('name')}, role_uid if role_uid != '0' else None)
+        if non_unique:
+            raise form.FormValidationError({k: self.t('value_is_not_unique') for k in non_unique})
+
     def _on_submit(self):
         role_uid = self.attr('role_uid')
 
         if role_uid == '0':
             role = auth.create_role(self.val('name'), self.val('description'))
         else:
-            role = auth.get_role(uid=role_uid)
+            role = _identity_map.get_role(uid=role_uid)
 
-        for k, v in self.values.items():
-            if role.has_field(k):
-                role.set_field(k, v)
+        changed_fields = set_changed_fields(role, {k: v for k, v in self.values.items() if role.has_field(k)})
+
+        # Skip storage write and events if nothing changed
+        if role_uid != '0' and not changed_fields:
+            return
 
         role.save()
 
+        events.fire('auth_ui@role_form_submit', role=role, changed_fields=changed_fields)
+
 
 class User(form.Form):
     def _on_setup_form(self):
@@ -109,7 +173,7 @@ class User(form.Form):
 
         # Only profile owners and admins can modify profiles
         if user_uid != '0':
-            user = auth.get_user(uid=self.attr('user_uid'))
+            user = _identity_map.get_user(uid=self.attr('user_uid'))
             if not (c_user.is_admin or c_user == user):
                 raise errors.ForbidOperation()
 
@@ -123,7 +187,7 @@ class User(form.Form):
 
     def _on_setup_widgets(self):
         user_uid = self.attr('user_uid')
-        user = auth.get_user(uid=user_uid) if user_uid != '0' else None
+        user = _identity_map.get_user(uid=user_uid) if user_uid != '0' else None
         c_user = auth.get_current_user()
 
         row_1 = self.add_widget(widget.container.Card(
@@ -164,11 +228,6 @@ class User(form.Form):
             enabled=c_user.is_admin,
             max_length=auth.LOGIN_MAX_LENGTH,
         ))
-        self.add_rule('login', auth.validation.AuthEntityFieldUnique(
-            e_type='user',
-            field_name='login',
-            exclude_uids=user.uid if user else None,
-        ))
 
         # Nickname
         row_1_center.append_child(widget.input.Text(
@@ -178,14 +237,9 @@ class User(form.Form):
             required=True,
             max_length=auth.NICKNAME_MAX_LENGTH,
         ))
-        self.add_rules('nickname', (
-            auth.user_nickname_rule,
-            auth.validation.AuthEntityFieldUnique(
-                e_type='user',
-                field_name='nickname',
-                exclude_uids=user.uid if user else None,
-            )
-        ))
+
+        # Uniqueness of login and nickname is checked in _on_validate() using single query
+        self.add_rule('nickname', auth.user_nickname_rule)
 
         # Birth date
         row_1_center.append_child(widget.select.DateTime(
@@ -434,7 +488,7 @@ class User(form.Form):
 
             admin.append_child(_widget.RolesCheckboxes(
                 uid='roles',
-                value=user.roles if user else [auth.get_role(r) for r in auth.get_new_user_roles()],
+                value=user.roles if user else [_identity_map.get_role(r) for r in auth.get_new_user_roles()],
                 label=self.t('roles'),
                 css='col-xs-12 col-12 col-md-3'
             ))
@@ -459,6 +513,11 @@ class User(form.Form):
                 'password_confirm': err_msg,
             })
 
+        user_uid = self.attr('user_uid')
+        unique_values = {'login': self.val('login'), 'nickname': self.val('nickname')}
+        for k in _find_non_unique_fields('user', unique_values, user_uid if user_uid != '0' else None):
+            errs[k] = self.t('value_is_not_unique')
+
         if errs:
             raise form.FormValidationError(errs)
 
@@ -469,8 +528,10 @@ class User(form.Form):
         if user_uid == '0':
             user = auth.create_user(self.val('login'), self.val('password'))
         else:
-            user = auth.get_user(uid=user_uid)
+            user = _identity_map.get_user(uid=user_uid)
 
+        old_nickname = user.nickname
+        values = {}
         for k, v in self.values.items():
             if not user.has_field(k):
                 continue
@@ -478,9 +539,17 @@ class User(form.Form):
             if k in ('login', 'status', 'roles') and not c_user.is_admin:
                 continue
 
-            user.set_field(k, v)
+            values[k] = v
+
+        changed_fields = set_changed_fields(user, values)
+
+        # Skip storage write and events if nothing changed
+        if user_uid == '0' or changed_fields:
+            user.save()
+            events.fire('auth_ui@user_form_submit', user=user, changed_fields=changed_fields)
 
-        user.save()
+        if 'nickname' in changed_fields:
+            _identity_map.forget_nickname(old_nickname)
 
         if not self.redirect:
-            self.redirect = router.rule_url('auth_ui@user_profile_view', {'nickname': user.nickname})
+            self.redirect = _api.user_profile_view_url(user.nickname)
@@ -4,19 +4,47 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from pytsite import routing
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from typing import Optional, Tuple
+from pytsite import routing, reg, http
 from plugins import auth, query
+from . import _user_index, _cache, _bulk
+
+# Search results cache, cleared on every user change
+user_select_cache = _cache.LRUCache(reg.get('auth_ui.user_select_cache_size', 1000),
+                                    reg.get('auth_ui.user_select_cache_ttl', 30))
+
+# Concurrent identical searches share a single storage call
+user_select_flight = _cache.SingleFlight()
+
+
+def _encode_cursor(rank: int, first_name: str, uid: str) -> str:
+    return urlsafe_b64encode(json.dumps([rank, first_name, uid]).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor: str) -> Optional[Tuple[int, str, str]]:
+    try:
+        rank, first_name, uid = json.loads(urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        return int(rank), str(first_name), str(uid)
+    except (ValueError, TypeError, UnicodeError):
+        return None
 
 
 class GetWidgetUserSelect(routing.Controller):
-    def _get_query(self) -> query.Query:
+    # UID breaks ties between equal first names, so pages of a storage query never overlap or skip users
+    _SORT = [('first_name', 1), ('_id', 1)]
+
+    def _get_query(self, search: str, after: Tuple[str, str] = None) -> query.Query:
         q = query.Query()
 
+        if after:
+            q.add(query.Gte('first_name', after[0]))
+
         if not auth.get_current_user().is_admin:
             q.add(query.Eq('status', 'active'))
             q.add(query.Eq('is_public', True))
 
-        search = self.arg('q')
         if search:
             q.add(query.Or([
                 query.Regex('first_name', search, True),
@@ -26,14 +54,49 @@ class GetWidgetUserSelect(routing.Controller):
         return q
 
     @staticmethod
-    def _format_option_text(user: auth.AbstractUser) -> str:
-        r = user.first_last_name
+    def _format_option_text(row: _user_index.UserRow, is_admin: bool) -> str:
+        r = row.first_last_name
+
+        if is_admin:
+            r += ' ({})'.format(row.login)
+
+        return r
+
+    def _find_after(self, search: str, after: Tuple[str, str], limit: int) -> list:
+        """Get users which go after the cursor using storage query
 
-        if auth.get_current_user().is_admin:
-            r += ' ({})'.format(user.login)
+        Users having the same first name as the cursor are filtered out here up to the cursor's UID.
+        """
+        r = []
+        skip = 0
+        while len(r) < limit:
+            batch = list(auth.find_users(self._get_query(search, after), self._SORT, limit, skip))
+            r += [u for u in batch if (u.first_name or '', u.uid) > after][:limit - len(r)]
+            if len(batch) < limit:
+                break
+            skip += limit
 
         return r
 
+    def _search(self, search: str, is_admin: bool, limit: int, skip: int,
+                after: Tuple[int, str, str] = None) -> dict:
+        # Search index is the primary source, regex query is used only if the index is not available
+        rows = _user_index.search(search, not is_admin, limit, 0 if after else skip, after)
+        if rows is None:
+            # Storage query results are not ranked
+            if after:
+                f = self._find_after(search, after[1:], limit)
+            else:
+                f = auth.find_users(self._get_query(search), self._SORT, limit, skip)
+            rows = [(_user_index.RANK_EXACT, _user_index.make_row(u)) for u in f]
+
+        last_rank, last_row = rows[-1] if rows and len(rows) == limit else (None, None)
+
+        return {
+            'results': [{'id': r.uid, 'text': self._format_option_text(r, is_admin)} for _, r in rows],
+            'cursor': _encode_cursor(last_rank, last_row.first_name, last_row.uid) if last_row else None,
+        }
+
     def exec(self):
         c_user = auth.get_current_user()
         if c_user.is_anonymous:
@@ -45,8 +108,85 @@ class GetWidgetUserSelect(routing.Controller):
         if limit > 100:
             limit = 100
 
-        f = auth.find_users(self._get_query(), [('first_name', 1)], limit, skip)
+        # Cursor replaces skip when provided
+        after = _decode_cursor(self.arg('cursor')) if self.arg('cursor') else None
 
-        return {
-            'results': [{'id': u.uid, 'text': self._format_option_text(u)} for u in f]
-        }
+        # Normalized search string is used both as a part of the cache key and to build the storage query
+        search = ' '.join((self.arg('q') or '').casefold().split())
+        cache_key = (search, c_user.is_admin, limit, skip, after)
+
+        try:
+            return user_select_cache.get(cache_key)
+        except _cache.KeyNotExist:
+            return user_select_flight.do(cache_key, lambda: user_select_cache.put(
+                cache_key, self._search(search, c_user.is_admin, limit, skip, after)))
+
+
+class BadRequest(http.error.E4xx):
+    code = 400
+    description = 'Bad request'
+
+
+class PostUsersBulk(routing.Controller):
+    """Start bulk modification of users
+    """
+
+    @staticmethod
+    def _load_list(value, name: str) -> list:
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                raise BadRequest("Argument '{}' is not a valid JSON".format(name))
+
+        if not isinstance(value, list) or [v for v in value if not isinstance(v, str)]:
+            raise BadRequest("Argument '{}' must be a list of strings".format(name))
+
+        return value
+
+    def exec(self):
+        if not auth.get_current_user().is_admin:
+            raise self.forbidden()
+
+        uids = self._load_list(self.arg('uids'), 'uids')
+        if not uids:
+            raise BadRequest("Argument 'uids' must not be empty")
+
+        max_uids = reg.get('auth_ui.bulk_max_uids', 10000)
+        if len(uids) > max_uids:
+            raise BadRequest("Argument 'uids' must not contain more than {} items".format(max_uids))
+
+        values = {}
+        for k in ('status', 'roles', 'is_public'):
+            if self.arg(k) is not None:
+                values[k] = self.arg(k)
+
+        if 'roles' in values:
+            values['roles'] = self._load_list(values['roles'], 'roles')
+        if 'is_public' in values and isinstance(values['is_public'], str):
+            values['is_public'] = values['is_public'].lower() in ('1', 'true', 'yes')
+        if 'status' in values and values['status'] not in dict(auth.get_user_statuses()):
+            raise BadRequest('Invalid status')
+
+        if not values:
+            raise BadRequest('Nothing to modify')
+
+        try:
+            return {'job_uid': _bulk.start(uids, values)}
+        except ValueError as e:
+            raise BadRequest(str(e))
+
+
+class GetUsersBulk(routing.Controller):
+    """Get progress of bulk modification of users
+    """
+
+    def exec(self):
+        if not auth.get_current_user().is_admin:
+            raise self.forbidden()
+
+        progress = _bulk.get_progress(self.arg('job_uid'))
+        if progress is None:
+            raise self.not_found()
+
+        return progress
@@ -0,0 +1,130 @@
+"""PytSite Auth UI Plugin Request Scoped Identity Map
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Callable, Optional
+from pytsite import router, reg
+from plugins import auth
+from . import _cache
+
+_ATTR_NAME = '_auth_ui_identity_map'
+
+# Nickname to UID mapping; unknown nicknames are kept with _NOT_FOUND as a value
+nickname_cache = _cache.LRUCache(reg.get('auth_ui.nickname_cache_size', 10000),
+                                 reg.get('auth_ui.nickname_cache_ttl', 3600))
+
+_NOT_FOUND = object()
+
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _map() -> Optional[dict]:
+    """Get identity map of the current request
+    """
+    request = router.request()
+    if request is None:
+        return None
+
+    try:
+        return getattr(request, _ATTR_NAME)
+    except AttributeError:
+        m = {'hits': 0, 'misses': 0, 'entities': {}}
+        setattr(request, _ATTR_NAME, m)
+        return m
+
+
+def _get(e_type: str, key_name: str, key_value: str, loader: Callable):
+    m = _map()
+    if m is None:
+        return loader()
+
+    key = (e_type, key_name, key_value)
+    entity = m['entities'].get(key)
+    if entity is not None:
+        m['hits'] += 1
+        _stats['hits'] += 1
+        return entity
+
+    m['misses'] += 1
+    _stats['misses'] += 1
+    entity = loader()
+
+    m['entities'][(e_type, 'uid', entity.uid)] = entity
+    if e_type == 'user':
+        m['entities'][(e_type, 'nickname', entity.nickname)] = entity
+    else:
+        m['entities'][(e_type, 'name', entity.name)] = entity
+
+    return entity
+
+
+def _load_user_by_nickname(nickname: str) -> auth.AbstractUser:
+    try:
+        uid = nickname_cache.get(nickname)
+    except _cache.KeyNotExist:
+        uid = None
+
+    if uid is _NOT_FOUND:
+        raise auth.error.UserNotFound("User with nickname '{}' not found".format(nickname))
+
+    if uid:
+        try:
+            user = auth.get_user(uid=uid)
+            # Nickname could be changed by another process
+            if user.nickname == nickname:
+                return user
+        except auth.error.UserNotFound:
+            pass
+
+    try:
+        user = auth.get_user(nickname=nickname)
+    except auth.error.UserNotFound:
+        nickname_cache.put(nickname, _NOT_FOUND, reg.get('auth_ui.nickname_negative_cache_ttl', 30))
+        raise
+
+    nickname_cache.put(nickname, user.uid)
+
+    return user
+
+
+def forget_nickname(nickname: str):
+    """Remove a nickname from the nickname to UID mapping
+    """
+    nickname_cache.rm(nickname)
+
+
+def get_user(uid: str = None, nickname: str = None) -> auth.AbstractUser:
+    """Get a user, loading it at most once per request
+    """
+    if uid:
+        return _get('user', 'uid', uid, lambda: auth.get_user(uid=uid))
+    elif nickname:
+        return _get('user', 'nickname', nickname, lambda: _load_user_by_nickname(nickname))
+    else:
+        raise ValueError('User UID or nickname expected')
+
+
+def get_role(name: str = None, uid: str = None) -> auth.model.AbstractRole:
+    """Get a role, loading it at most once per request
+    """
+    if uid:
+        return _get('role', 'uid', uid, lambda: auth.get_role(uid=uid))
+    elif name:
+        return _get('role', 'name', name, lambda: auth.get_role(name))
+    else:
+        raise ValueError('Role UID or name expected')
+
+
+def stats() -> dict:
+    """Get lookup counters of the current request and of the process
+    """
+    m = _map()
+
+    return {
+        'request_hits': m['hits'] if m else 0,
+        'request_misses': m['misses'] if m else 0,
+        'hits': _stats['hits'],
+        'misses': _stats['misses'],
+    }
@@ -0,0 +1,163 @@
+"""PytSite Auth UI Plugin Mail Queue
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import atexit
+import queue
+import threading
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from smtplib import SMTP
+from time import time, sleep
+from typing import Dict, Tuple
+from pytsite import mail, reg, logger
+
+_queue = queue.Queue(reg.get('auth_ui.mail_queue_size', 1000))
+_workers = []
+_lock = threading.Lock()
+_stats = {'sent': 0, 'failed': 0, 'retried': 0, 'sent_inline': 0}
+
+# Retries waiting for their backoff delay: {timer: (item, attempt)}
+_pending_retries = {}  # type: Dict[threading.Timer, Tuple[tuple, int]]
+
+
+def _count(key: str):
+    with _lock:
+        _stats[key] += 1
+
+
+def _build(msg: mail.Message) -> Tuple[str, tuple, str, str]:
+    """Build message's MIME text once
+
+    SHIM: mail.Message has no public way to get its MIME text without sending, and mail.Message.send() starts its own
+    thread and only logs errors, so delivery errors could not be retried. This repeats what Message.send() of pytsite
+    9.x does before sending and relies on its private '_attachments' attribute; it must be revised together with
+    pytsite's mail.Message.
+    """
+    MIMEMultipart.attach(msg, MIMEText(msg.body, 'html', 'utf-8'))
+    for attachment in msg._attachments:
+        MIMEMultipart.attach(msg, attachment)
+
+    return msg.from_addr, msg.to_addrs, msg.subject, msg.as_string()
+
+
+def _retry(item: tuple, attempt: int):
+    try:
+        _queue.put_nowait((item, attempt))
+    except queue.Full:
+        _send_inline(item, attempt)
+
+
+def _on_retry_timer(item: tuple, attempt: int):
+    # Retry may already be taken by _expedite_retries()
+    with _lock:
+        if _pending_retries.pop(threading.current_thread(), None) is None:
+            return
+
+    _retry(item, attempt)
+
+
+def _send(item: tuple, attempt: int):
+    from_addr, to_addrs, subject, data = item
+
+    try:
+        with SMTP(reg.get('auth_ui.mail_smtp_host', 'localhost')) as smtp:
+            smtp.sendmail(from_addr, to_addrs, data)
+        _count('sent')
+        logger.info("Message '{}' has been sent to {}".format(subject, to_addrs))
+    except Exception as e:
+        if attempt + 1 >= reg.get('auth_ui.mail_max_attempts', 5):
+            _count('failed')
+            logger.error('Cannot send notification message to {}: {}'.format(to_addrs, e), exc_info=e)
+            return
+
+        # Exponential backoff without blocking the worker
+        _count('retried')
+        delay = reg.get('auth_ui.mail_retry_delay', 5) * 2 ** attempt
+        timer = threading.Timer(delay, _on_retry_timer, (item, attempt + 1))
+        timer.daemon = True
+        with _lock:
+            _pending_retries[timer] = (item, attempt + 1)
+        timer.start()
+
+
+def _send_inline(item: tuple, attempt: int = 0):
+    _count('sent_inline')
+    _send(item, attempt)
+
+
+def _work():
+    while True:
+        item, attempt = _queue.get()
+        try:
+            _send(item, attempt)
+        finally:
+            _queue.task_done()
+
+
+def _start_workers():
+    with _lock:
+        while len(_workers) < reg.get('auth_ui.mail_workers', 2):
+            worker = threading.Thread(target=_work, name='auth_ui.mail_queue.{}'.format(len(_workers)), daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def enqueue(msg: mail.Message):
+    """Put a message to the sending queue
+
+    If the queue is full, the message is sent in the current thread.
+    """
+    if not _workers:
+        _start_workers()
+
+    item = _build(msg)
+    try:
+        _queue.put_nowait((item, 0))
+    except queue.Full:
+        _send_inline(item)
+
+
+def _expedite_retries():
+    """Cancel backoff delays of pending retries and queue them immediately
+    """
+    with _lock:
+        retries = list(_pending_retries.items())
+        _pending_retries.clear()
+
+    for timer, (item, attempt) in retries:
+        timer.cancel()
+        _retry(item, attempt)
+
+
+def flush(timeout: float = None):
+    """Wait until all queued messages, including ones waiting for a retry, are processed
+
+    Retries are not delayed while flushing.
+    """
+    if timeout is None:
+        timeout = reg.get('auth_ui.mail_flush_timeout', 10)
+
+    deadline = time() + timeout
+    while (_queue.unfinished_tasks or _pending_retries) and time() < deadline:
+        _expedite_retries()
+        sleep(0.05)
+
+
+def stats() -> dict:
+    """Get queue statistics
+    """
+    with _lock:
+        r = dict(_stats)
+
+    r.update({
+        'depth': _queue.qsize(),
+        'workers': len(_workers),
+    })
+
+    return r
+
+
+atexit.register(flush)
@@ -0,0 +1,134 @@
+"""PytSite Auth UI Plugin Notifications Helpers
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import atexit
+import threading
+from typing import Dict, Iterable, List, Tuple
+from pytsite import tpl, reg, util, mail
+from plugins import auth
+from . import _cache, _mail_queue
+
+# Personal admin's fields which can be used in notification templates
+_ADMIN_FIELDS = ('full_name', 'first_last_name', 'first_name', 'last_name', 'login', 'nickname')
+
+_admins_cache = _cache.LRUCache(1, reg.get('auth_ui.admins_cache_ttl', 300))
+
+# Status change messages waiting for the end of coalescing window: {user_uid: message}
+_pending_status_messages = {}  # type: Dict[str, mail.Message]
+_pending_lock = threading.Lock()
+_flush_timer = None  # type: threading.Timer
+
+
+class _AdminPlaceholder:
+    """Stands for an admin while rendering a template once for all admins
+    """
+
+    def __init__(self):
+        self.is_personalizable = True
+
+    def __getattr__(self, name: str):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        if name in _ADMIN_FIELDS:
+            return placeholder(name)
+
+        # Template uses something which cannot be substituted, so it must be rendered for every admin
+        self.is_personalizable = False
+
+        return None
+
+
+def placeholder(field: str) -> str:
+    """Get placeholder of an admin's field
+    """
+    return 'AUTHUIADMINFIELD' + field.replace('_', '').upper()
+
+
+def get_admin_users() -> List[auth.AbstractUser]:
+    """Get admin users
+    """
+    try:
+        return _admins_cache.get('admins')
+    except _cache.KeyNotExist:
+        return _admins_cache.put('admins', list(auth.get_admin_users()))
+
+
+def invalidate_admin_users(user: auth.AbstractUser = None):
+    """Drop admin users cache
+
+    If a user is given, the cache is dropped only if the user is or was an admin.
+    """
+    if user:
+        try:
+            if not (user.is_admin or user.uid in [a.uid for a in _admins_cache.get('admins')]):
+                return
+        except _cache.KeyNotExist:
+            return
+
+    _admins_cache.clear()
+
+
+def render_for_admins(tpl_name: str, args: dict) -> Iterable[Tuple[auth.AbstractUser, str]]:
+    """Render a template for every admin user
+
+    The template is rendered once with placeholders instead of admin's personal fields, which are then substituted for
+    every admin. If the template uses other admin's properties, it is rendered for every admin.
+    """
+    admins = get_admin_users()
+    if not admins:
+        return
+
+    admin_placeholder = _AdminPlaceholder()
+    body = tpl.render(tpl_name, dict(args, admin=admin_placeholder))
+
+    for admin in admins:
+        if admin_placeholder.is_personalizable:
+            msg = body
+            for field in _ADMIN_FIELDS:
+                if placeholder(field) in msg:
+                    msg = msg.replace(placeholder(field), util.escape_html(getattr(admin, field) or ''))
+        else:
+            msg = tpl.render(tpl_name, dict(args, admin=admin))
+
+        yield admin, msg
+
+
+def flush_status_change_messages():
+    """Send pending status change messages
+    """
+    global _flush_timer
+
+    with _pending_lock:
+        messages = list(_pending_status_messages.values())
+        _pending_status_messages.clear()
+        _flush_timer = None
+
+    for msg in messages:
+        _mail_queue.enqueue(msg)
+
+
+def schedule_status_change_message(user: auth.AbstractUser, msg: mail.Message):
+    """Schedule user's status change message
+
+    Messages are sent after a coalescing window, only the last message per user within the window is sent.
+    """
+    global _flush_timer
+
+    delay = reg.get('auth_ui.status_change_notify_delay', 60)
+    if not delay:
+        _mail_queue.enqueue(msg)
+        return
+
+    with _pending_lock:
+        _pending_status_messages[user.uid] = msg
+        if not _flush_timer:
+            _flush_timer = threading.Timer(delay, flush_status_change_messages)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+
+atexit.register(flush_status_change_messages)
@@ -0,0 +1,73 @@
+"""PytSite Auth UI Plugin Sign Up Confirmation Tokens
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Optional
+from datetime import datetime, timedelta
+from pytsite import cache, reg, logger
+from plugins import auth, query
+
+_pool = cache.create_pool('auth_ui@confirmation_tokens')
+
+
+def get_ttl() -> int:
+    """Get confirmation tokens' lifetime in seconds
+    """
+    return reg.get('auth_ui.confirmation_token_ttl', 86400 * 7)
+
+
+def put(token: str, user_uid: str):
+    """Store a confirmation token
+    """
+    # Single item list is stored, so the token can be taken atomically by list_l_pop()
+    _pool.put_list(token, [user_uid], get_ttl())
+
+
+def pop(token: str) -> Optional[str]:
+    """Get UID of a user the token was issued to and remove the token
+
+    Only one of concurrent calls with the same token gets the UID.
+    """
+    try:
+        return _pool.list_l_pop(token)
+    except cache.error.KeyNotExist:
+        return None
+
+
+def sweep_waiting_users():
+    """Delete users which did not confirm their registration in time
+
+    Users are processed in small chunks, each chunk is a separate query, so no long running operation holds storage.
+    Expired tokens themselves are removed by the cache pool.
+    """
+    ttl = reg.get('auth_ui.waiting_users_ttl', 0)
+    if not ttl:
+        return
+
+    chunk_size = reg.get('auth_ui.waiting_users_sweep_chunk_size', 100)
+    q = query.Query([
+        query.Eq('status', auth.USER_STATUS_WAITING),
+        query.Lt('created', datetime.now() - timedelta(seconds=ttl)),
+    ])
+
+    deleted = 0
+    while True:
+        users = list(auth.find_users(q, [('created', 1)], chunk_size))
+        if not users:
+            break
+
+        try:
+            auth.switch_user_to_system()
+            for user in users:
+                user.delete()
+                deleted += 1
+        finally:
+            auth.restore_user()
+
+        if len(users) < chunk_size:
+            break
+
+    if deleted:
+        logger.info('{} unconfirmed user accounts deleted'.format(deleted))
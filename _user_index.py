@@ -0,0 +1,257 @@
+"""PytSite Auth UI Plugin Users Search Index
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import re
+import threading
+import unicodedata
+from collections import namedtuple
+from heapq import nsmallest
+from time import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from pytsite import reg, logger, threading as pytsite_threading
+from plugins import auth, query
+
+RANK_EXACT = 0
+RANK_PREFIX = 1
+RANK_INFIX = 2
+
+_PREFIX_MAX_LEN = 10
+_TOKEN_SPLIT_RE = re.compile(r'\W+')
+_REPEATED_CHARS_RE = re.compile(r'(.)\1+')
+
+# Cyrillic (ru, uk) to Latin transliteration
+_TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'ґ': 'g', 'д': 'd', 'е': 'e', 'є': 'ie', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'і': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e',
+    'ю': 'iu', 'я': 'ia', "'": '', '’': '',
+})
+
+# Latin spelling variants reduced to a single form, applied after transliteration
+_LATIN_VARIANTS = (('kh', 'h'), ('j', 'i'), ('y', 'i'), ('w', 'v'), ('x', 'ks'), ('ck', 'k'))
+
+# Projection of user's fields needed to search and to build select options
+UserRow = namedtuple('UserRow', ('uid', 'first_name', 'last_name', 'first_last_name', 'login', 'status', 'is_public',
+                                 'search_key'))
+
+_lock = threading.Lock()
+_rows = {}  # type: Dict[str, UserRow]
+_keys = {}  # type: Dict[Tuple[str, str], Set[str]]
+_built_at = 0.0
+_is_building = False
+_changed = {}  # type: Dict[str, Optional[UserRow]]
+
+
+def normalize(s: str) -> str:
+    """Normalize a string for search
+
+    The string is casefolded, diacritics are stripped, Cyrillic is transliterated and Latin spelling variants are
+    reduced, so 'Юрій', 'Yuriy' and 'Iurii' produce the same key.
+    """
+    s = unicodedata.normalize('NFKD', (s or '').casefold())
+    s = ''.join(c for c in s if not unicodedata.combining(c)).translate(_TRANSLIT)
+    for k, v in _LATIN_VARIANTS:
+        s = s.replace(k, v)
+
+    return ' '.join(_REPEATED_CHARS_RE.sub(r'\1', t) for t in _TOKEN_SPLIT_RE.split(s) if t)
+
+
+def _trigrams(token: str) -> Set[str]:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def make_row(user: auth.AbstractUser) -> UserRow:
+    """Make user's row
+    """
+    first_name = user.first_name or ''
+    last_name = user.last_name or ''
+
+    return UserRow(user.uid, first_name, last_name, user.first_last_name, user.login, user.status, user.is_public,
+                   normalize(first_name + ' ' + last_name))
+
+
+def _index_keys(row: UserRow) -> Iterable[Tuple[str, str]]:
+    for token in row.search_key.split():
+        for i in range(1, min(len(token), _PREFIX_MAX_LEN) + 1):
+            yield 'p', token[:i]
+        for trigram in _trigrams(token):
+            yield 't', trigram
+
+
+def _add(rows: Dict[str, UserRow], keys: Dict[Tuple[str, str], Set[str]], row: UserRow):
+    rows[row.uid] = row
+
+    for k in _index_keys(row):
+        keys.setdefault(k, set()).add(row.uid)
+
+
+def _discard(rows: Dict[str, UserRow], keys: Dict[Tuple[str, str], Set[str]], uid: str):
+    row = rows.pop(uid, None)
+    if not row:
+        return
+
+    for k in _index_keys(row):
+        uids = keys.get(k)
+        if uids is not None:
+            uids.discard(uid)
+            if not uids:
+                del keys[k]
+
+
+def _build():
+    global _rows, _keys, _built_at, _is_building
+
+    rows = {}
+    keys = {}
+    started_at = time()
+
+    try:
+        for user in auth.find_users(query.Query()):
+            _add(rows, keys, make_row(user))
+    except Exception as e:
+        logger.error('Error while building users search index: {}'.format(e), exc_info=e)
+        with _lock:
+            _changed.clear()
+            _is_building = False
+        return
+
+    with _lock:
+        # Apply changes made while the index was being built, they may be missed by the storage query
+        for uid, row in _changed.items():
+            _discard(rows, keys, uid)
+            if row:
+                _add(rows, keys, row)
+        _changed.clear()
+
+        _rows, _keys, _built_at, _is_building = rows, keys, started_at, False
+
+
+def is_enabled() -> bool:
+    """Check whether the users search index is enabled
+    """
+    return reg.get('auth_ui.user_index_enabled', True)
+
+
+def is_ready() -> bool:
+    """Check whether the users search index is built and not expired
+
+    Missing or expired index is rebuilt in a background thread started by the first check after expiration, the
+    previous index is served meanwhile. The expiration bounds the time other processes' changes stay invisible,
+    because save events are delivered only to the process which performed the save.
+    """
+    global _is_building
+
+    if not is_enabled():
+        return False
+
+    with _lock:
+        if not _is_building and time() - _built_at > reg.get('auth_ui.user_index_ttl', 600):
+            _is_building = True
+            pytsite_threading.run_in_thread(_build)
+
+        return bool(_built_at)
+
+
+def update(user: auth.AbstractUser):
+    """Add or update a user in the index
+    """
+    row = make_row(user)
+
+    with _lock:
+        if _is_building:
+            _changed[user.uid] = row
+
+        if not _built_at:
+            return
+
+        _discard(_rows, _keys, user.uid)
+        _add(_rows, _keys, row)
+
+
+def remove(user: auth.AbstractUser):
+    """Remove a user from the index
+    """
+    with _lock:
+        if _is_building:
+            _changed[user.uid] = None
+
+        _discard(_rows, _keys, user.uid)
+
+
+def reset():
+    """Drop the index, it will be rebuilt on the next search
+    """
+    global _rows, _keys, _built_at
+
+    with _lock:
+        _rows, _keys, _built_at = {}, {}, 0.0
+
+
+def _find_token(token: str) -> Set[str]:
+    """Find UIDs of users having the token as a prefix or, if it is long enough, as an infix of a name's word
+    """
+    r = _keys.get(('p', token[:_PREFIX_MAX_LEN]), set())
+    if len(token) > _PREFIX_MAX_LEN:
+        r = {uid for uid in r if (' ' + _rows[uid].search_key).find(' ' + token) >= 0}
+
+    if len(token) >= 3:
+        infix = None  # type: Optional[Set[str]]
+        for trigram in _trigrams(token):
+            infix = _keys.get(('t', trigram), set()) if infix is None else infix & _keys.get(('t', trigram), set())
+            if not infix:
+                break
+        if infix:
+            r = r | {uid for uid in infix if token in _rows[uid].search_key}
+
+    return r
+
+
+def _rank(row: UserRow, tokens: List[str]) -> int:
+    row_tokens = row.search_key.split()
+
+    if all(t in row_tokens for t in tokens):
+        return RANK_EXACT
+
+    if all(any(rt.startswith(t) for rt in row_tokens) for t in tokens):
+        return RANK_PREFIX
+
+    return RANK_INFIX
+
+
+def search(s: str, public_only: bool = True, limit: int = 10, skip: int = 0,
+           after: Tuple[int, str, str] = None) -> Optional[List[Tuple[int, UserRow]]]:
+    """Search for users by first and last names
+
+    Every word of the search string must be a prefix or an infix of a word of the user's first or last name, compared
+    in normalized form. Results are (rank, row) pairs sorted by rank (exact match, prefix, infix), first name and UID,
+    `after` is a (rank, first_name, uid) tuple to start after. Returns None if the index is not available, so the
+    caller can fall back to a storage query.
+    """
+    if not is_ready():
+        return None
+
+    tokens = normalize(s).split()
+
+    with _lock:
+        if tokens:
+            uids = None  # type: Optional[Set[str]]
+            for token in sorted(set(tokens), key=len, reverse=True):
+                uids = _find_token(token) if uids is None else uids & _find_token(token)
+                if not uids:
+                    return []
+            rows = [_rows[uid] for uid in uids]
+        else:
+            rows = list(_rows.values())
+
+    if public_only:
+        rows = [r for r in rows if r.status == 'active' and r.is_public]
+
+    ranked = [(_rank(r, tokens) if tokens else RANK_EXACT, r.first_name, r.uid, r) for r in rows]
+
+    if after:
+        ranked = [r for r in ranked if r[:3] > after]
+
+    return [(r[0], r[3]) for r in nsmallest(skip + limit, ranked, key=lambda r: r[:3])[skip:]]
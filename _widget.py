@@ -7,8 +7,34 @@ __license__ = 'MIT'
 import json
 import htmler
 from typing import Union, List, Tuple
-from pytsite import lang
+from pytsite import lang, reg
 from plugins import widget, auth, http_api
+from . import _identity_map, _cache
+
+# Roles checkboxes items per language, cleared on every role change
+roles_items_cache = _cache.LRUCache(100, reg.get('auth_ui.roles_cache_ttl', 300))
+
+
+def _get_roles_items() -> List[Tuple[str, str]]:
+    try:
+        return roles_items_cache.get(lang.get_current())
+    except _cache.KeyNotExist:
+        pass
+
+    items = []
+    for role in auth.find_roles():
+        if role.name == 'anonymous':
+            continue
+
+        role_desc = role.description
+        try:
+            role_desc = lang.t(role_desc)
+        except lang.error.Error:
+            pass
+
+        items.append((role.uid, role_desc))
+
+    return roles_items_cache.put(lang.get_current(), items)
 
 
 class RolesCheckboxes(widget.select.Checkboxes):
@@ -18,20 +44,7 @@ class RolesCheckboxes(widget.select.Checkboxes):
     def __init__(self, uid: str, **kwargs):
         """Init
         """
-        items = []
-        for role in auth.find_roles():
-            if role.name == 'anonymous':
-                continue
-
-            role_desc = role.description
-            try:
-                role_desc = lang.t(role_desc)
-            except lang.error.Error:
-                pass
-
-            items.append((role.uid, role_desc))
-
-        super().__init__(uid, items=items, **kwargs)
+        super().__init__(uid, items=list(_get_roles_items()), **kwargs)
 
     def set_val(self, value: Union[List, Tuple]):
         """Set value of the widget.
@@ -66,7 +79,7 @@ class UserSelect(widget.select.Select2):
             value = value.uid
         elif isinstance(value, str):
             value = value.strip()
-            value = auth.get_user(uid=value).uid if value else None
+            value = _identity_map.get_user(uid=value).uid if value else None
         elif value is not None:
             raise TypeError('User object, str or None expected, not {}'.format(repr(value)))
 
@@ -75,7 +88,7 @@ class UserSelect(widget.select.Select2):
     def get_val(self, **kwargs) -> auth.model.AbstractUser:
         value = super().get_val(**kwargs)
         if value:
-            value = auth.get_user(uid=value)
+            value = _identity_map.get_user(uid=value)
 
         return value
 
@@ -100,10 +113,17 @@ class UsersSlots(widget.Abstract):
         self._modal_title = kwargs.get('modal_title', lang.t('auth_ui@select_user'))
         self._modal_ok_button_caption = kwargs.get('modal_ok_button_caption', lang.t('auth_ui@add'))
         self._modal_cancel_button_caption = kwargs.get('modal_cancel_button_caption')
+        self._prefetch_users = kwargs.get('prefetch_users', True)
 
     def _get_element(self, **kwargs) -> htmler.Element:
+        users = self.value or []
+
+        # Embed users' data to avoid an extra HTTP API request from the browser
+        if self._prefetch_users:
+            self.data['users'] = json.dumps([u.as_jsonable() for u in users])
+
         self.data.update({
-            'value': json.dumps([u.uid for u in (self.value or [])]),
+            'value': json.dumps([u.uid for u in users]),
             'max_slots': self._max_slots,
             'modal_title': self._modal_title,
             'modal_ok_button_caption': self._modal_ok_button_caption,
@@ -31,6 +31,7 @@ export default class UsersSlots extends React.Component {
         onSlotClick: PropTypes.func,
         slotContent: PropTypes.func,
         userTitleFormat: PropTypes.string,
+        users: PropTypes.arrayOf(PropTypes.object),
         value: PropTypes.arrayOf(PropTypes.string),
     };
 
@@ -45,8 +46,11 @@ export default class UsersSlots extends React.Component {
     constructor(props) {
         super(props);
 
+        const users = {};
+        this.props.users && this.props.users.map(user => users[user.uid] = user);
+
         this.state = {
-            users: {},
+            users: users,
             isModalOpened: false,
             modalSelectedUserUid: null,
             userToReplaceUid: null,
@@ -62,6 +66,10 @@ export default class UsersSlots extends React.Component {
     }
 
     componentDidMount() {
+        // Users' data was embedded by the server
+        if (this.props.users)
+            return;
+
         httpApi.get('auth/users', {uids: JSON.stringify(this.props.value)}).then(data => {
             const users = {};
             data.map(user => users[user.uid] = user);
@@ -207,6 +215,7 @@ export default class UsersSlots extends React.Component {
 setupWidget('plugins.auth_ui._widget.UsersSlots', widget => {
     const c = <UsersSlots name={widget.uid}
                           value={widget.data('value')}
+                          users={widget.data('users')}
                           enabled={widget.data('enabled') === 'True'}
                           maxSlots={widget.data('maxSlots')}
                           modalTitle={widget.data('modalTitle')}